@@ -23,14 +23,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.  
 # 
-# $pip install requests tqdm
+# $pip install requests 'httpx[http2]' orjson tqdm
 # 
 # Clone all repositories from the Electronic Arts GitHub organization into a local folder
 # with an overall progress bar.
 # 
 # Usage:
 #   python clone_ea_org.py [--dest electronicarts] [--token GITHUB_TOKEN] [--ssh]
-#                          [--include-archived] [--workers 4] [--full] [--mirror]
+#                          [--include-archived] [--workers 4] [--jobs 2] [--full] [--mirror] [--all-branches]
+#                          [--cow-snapshot] [--verbose]
 # 
 # Examples:
 #   # Shallow clone (depth=1) all repos via HTTPS into ./electronicarts
@@ -44,20 +45,43 @@
 # 
 """
 import argparse
-import concurrent.futures
-import json
+import asyncio
+import atexit
+import collections
+import hashlib
+import logging
+import math
 import os
+import shlex
+import shutil
 import subprocess
 import sys
+import tempfile
 import time
-from typing import List, Dict, Optional
+from enum import IntEnum
+from typing import Awaitable, Iterator, List, Dict, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 try:
     import requests  # type: ignore
+    from requests.adapters import HTTPAdapter  # type: ignore
+    from urllib3.util.retry import Retry  # type: ignore
 except Exception as e:
     print("This script requires the 'requests' package. Install it with: pip install requests tqdm", file=sys.stderr)
     raise
 
+try:
+    import httpx  # type: ignore
+except Exception as e:
+    print("This script requires the 'httpx' package with HTTP/2 support. Install it with: pip install 'httpx[http2]'", file=sys.stderr)
+    raise
+
+try:
+    import orjson  # type: ignore
+except Exception as e:
+    print("This script requires the 'orjson' package. Install it with: pip install orjson", file=sys.stderr)
+    raise
+
 try:
     from tqdm import tqdm  # type: ignore
 except Exception as e:
@@ -67,192 +91,898 @@ except Exception as e:
 
 ORG = "electronicarts"
 API_URL = f"https://api.github.com/orgs/{ORG}/repos"
+SSH_HOST = "git@github.com"
+PROGRESS_INTERVAL = 0.1  # seconds between progress bar refreshes while cloning
+COW_FILESYSTEMS = ("btrfs", "xfs")  # filesystems where `cp --reflink` shares extents
+SEARCH_URL = "https://api.github.com/search/repositories"
+SEARCH_MAX_RESULTS = 1000  # GitHub never returns more search results than this
+GRAPHQL_URL = "https://api.github.com/graphql"
+GRAPHQL_QUERY = """
+query($login: String!, $cursor: String) {
+  organization(login: $login) {
+    repositories(first: 100, after: $cursor) {
+      pageInfo { endCursor hasNextPage }
+      nodes { name url sshUrl isArchived }
+    }
+  }
+}
+"""
 
+DEFAULT_HEADERS = {"Accept": "application/vnd.github+json", "User-Agent": "clone_ea_org"}
+
+# One keep-alive session for all synchronous API calls, so the TLS handshake
+# is paid once; transient gateway errors are retried with backoff (POST too,
+# since our GraphQL calls are read-only queries).
+SESSION = requests.Session()
+SESSION.headers.update(DEFAULT_HEADERS)
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504], allowed_methods=None),
+))
+
+# Conditional-request cache: ETag per page URL plus the last run's repo snapshot
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "clone_ea_org")
+ETAGS_PATH = os.path.join(CACHE_DIR, "etags.json")
+STATE_PATH = os.path.join(CACHE_DIR, "state.json")
+PAGES_DIR = os.path.join(CACHE_DIR, "pages")
+SNAPSHOT_FIELDS = ("name", "clone_url", "ssh_url", "archived", "pushed_at")
+
+# Prefix for every git invocation: protocol v2 skips the full ref advertisement,
+# pack.threads=0 uses all cores, and no fsmonitor/auto-gc work after each command.
+GIT = ["git", "-c", "protocol.version=2", "-c", "pack.threads=0", "-c", "core.fsmonitor=false", "-c", "gc.auto=0"]
+
+# Extra environment for every git child process; abort transfers that stall
+# below 1 KB/s for 30s so the retry logic kicks in.
+GIT_ENV = {
+    "GIT_TERMINAL_PROMPT": "0",
+    "GIT_ASKPASS": "echo",
+    "GIT_HTTP_LOW_SPEED_LIMIT": "1000",
+    "GIT_HTTP_LOW_SPEED_TIME": "30",
+}
+
+
+# Per-repo diagnostics; main() prints warnings, and retry chatter (INFO) only with --verbose
+log = logging.getLogger("clone_ea_org")
+log.addHandler(logging.NullHandler())
+
+
+class TqdmHandler(logging.Handler):
+    """Logging handler that prints through tqdm.write so progress bars stay intact."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            tqdm.write(self.format(record))
+        except Exception:
+            self.handleError(record)
 
-def fetch_all_repos(token: Optional[str], include_archived: bool) -> List[Dict]:
-    """Fetch all repos from the org, handling pagination."""
-    headers = {"Accept": "application/vnd.github+json"}
-    if token:
-        headers["Authorization"] = f"Bearer {token.strip()}"
 
-    repos: List[Dict] = []
-    page = 1
-    per_page = 100
+class Status(IntEnum):
+    """Outcome of processing one repository."""
+    CLONED = 0
+    UPDATED = 1
+    FAILED = 2
+
+
+def load_json_file(path: str, default):
+    """Read a JSON file, returning `default` when it is missing or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return default
+
+
+def save_json_file(path: str, data) -> None:
+    """Atomically write `data` as JSON to `path`, doing nothing if it cannot be written."""
+    tmp = path + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(data))
+        os.replace(tmp, path)
+    except OSError:
+        pass  # the cache is an optimisation; e.g. a read-only HOME just means no caching
+
+
+def seconds_until_reset(resp) -> int:
+    """Seconds until the rate-limit window reported by `resp` resets."""
+    try:
+        return max(1, int(resp.headers["X-RateLimit-Reset"]) - int(time.time()) + 1)
+    except (KeyError, ValueError):
+        return 60
+
+
+def rate_limit_wait(resp) -> Optional[int]:
+    """Return how long to sleep if `resp` was rejected by a rate limit, else None.
+
+    Only a safety net: `rate_limit_pause` should stop us before this happens.
+    """
+    if resp.status_code not in (403, 429):
+        return None
+    retry_after = resp.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return max(1, int(retry_after))  # secondary rate limit
+    if resp.headers.get("X-RateLimit-Remaining") != "0":
+        return None
+    return seconds_until_reset(resp)
+
+
+def rate_limit_pause(resp, needed: int = 1) -> Optional[int]:
+    """Return how long to pause before sending `needed` more requests, else None."""
+    try:
+        remaining = int(resp.headers.get("X-RateLimit-Remaining", "5000"))
+    except ValueError:
+        return None
+    if remaining > needed:
+        return None
+    return seconds_until_reset(resp)
+
+
+def conditional_headers(headers: Dict[str, str], url: str, etags: Dict) -> Dict[str, str]:
+    """Add If-None-Match for `url` when its page is cached on disk."""
+    cached = etags.get(url)
+    if cached and os.path.exists(cached[1]):
+        return {**headers, "If-None-Match": cached[0]}
+    return headers
+
+
+def read_page(url: str, resp, etags: Dict) -> Tuple[List[Dict], Dict[str, str]]:
+    """Decode one listing page and its Link relations, using the cache on 304.
+
+    Works with both `requests` and `httpx` responses.
+    """
+    cached = etags.get(url)
+    if resp.status_code == 304 and cached:
+        # 304 carries no body and may omit the Link header, so both come from the cache
+        with open(cached[1], "rb") as f:
+            return orjson.loads(f.read()), cached[2]
+
+    resp.raise_for_status()
+    data = orjson.loads(resp.content)
+    if not isinstance(data, list):
+        raise RuntimeError(f"Unexpected response: {orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()[:4000]}")
+
+    links = {rel: link["url"] for rel, link in resp.links.items()}
+    etag = resp.headers.get("ETag")
+    if etag:
+        page_path = os.path.join(PAGES_DIR, hashlib.sha1(url.encode()).hexdigest() + ".json")
+        try:
+            os.makedirs(PAGES_DIR, exist_ok=True)
+            with open(page_path, "wb") as f:
+                f.write(resp.content)
+        except OSError:
+            return data, links  # not cached; the next run fetches this page in full
+        etags[url] = [etag, page_path, links]
+    return data, links
+
+
+def page_url(last_url: str, page: int) -> str:
+    """Build the URL of `page` from the Link rel="last" URL."""
+    parts = urlsplit(last_url)
+    query = dict(parse_qsl(parts.query))
+    query["page"] = str(page)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+async def fetch_pages(urls: List[str], headers: Dict[str, str], etags: Dict, bar) -> List[List[Dict]]:
+    """Fetch `urls` concurrently, multiplexed over a single HTTP/2 connection."""
+    limits = httpx.Limits(max_keepalive_connections=1, max_connections=1)
+    timeout = httpx.Timeout(60, pool=None)  # requests queue for the one connection
+
+    async with httpx.AsyncClient(http2=True, headers=DEFAULT_HEADERS, limits=limits, timeout=timeout) as client:
+        async def fetch_page(url: str) -> List[Dict]:
+            while True:
+                resp = await client.get(url, headers=conditional_headers(headers, url, etags))
+                wait_s = rate_limit_wait(resp)
+                if wait_s is None:
+                    break
+                tqdm.write(f"Hit rate limit. Sleeping {wait_s} seconds...")
+                await asyncio.sleep(wait_s)
+            data, _ = read_page(url, resp, etags)
+            bar.update(1)
+            return data
+
+        return await asyncio.gather(*(fetch_page(url) for url in urls))
+
+
+class ListingUnavailable(Exception):
+    """A listing method cannot serve this run; the caller should try the next one."""
+
+
+def iter_repos_graphql(token: str, include_archived: bool) -> Iterator[List[Dict]]:
+    """Yield the org's repos page by page through GraphQL, selecting only the fields we use.
+
+    Raises ListingUnavailable if the first page is refused, so the caller can
+    fall back to another listing method.
+    """
+    headers = {"Authorization": f"Bearer {token.strip()}"}
+    cursor: Optional[str] = None
 
     with tqdm(desc="Listing repositories from GitHub", unit="page") as bar:
         while True:
-            params = {
-                "per_page": per_page,
-                "page": page,
-                "type": "all",  # includes public and private if token has scope
-                "sort": "full_name",
-                "direction": "asc",
-            }
-            resp = requests.get(API_URL, headers=headers, params=params, timeout=60)
-            if resp.status_code == 403 and "rate limit" in resp.text.lower():
-                reset = resp.headers.get("X-RateLimit-Reset", "")
-                wait_s = 60
-                try:
-                    if reset:
-                        wait_s = max(1, int(reset) - int(time.time()))
-                except Exception:
-                    pass
+            payload = {"query": GRAPHQL_QUERY, "variables": {"login": ORG, "cursor": cursor}}
+            resp = SESSION.post(GRAPHQL_URL, headers=headers, json=payload, timeout=60)
+            wait_s = rate_limit_wait(resp)
+            if wait_s is not None:
                 tqdm.write(f"Hit rate limit. Sleeping {wait_s} seconds...")
                 time.sleep(wait_s)
                 continue
+            if resp.status_code in (401, 403) and cursor is None:
+                raise ListingUnavailable(f"GraphQL listing refused (HTTP {resp.status_code})")
 
             resp.raise_for_status()
-            data = resp.json()
-            if not isinstance(data, list):
-                raise RuntimeError(f"Unexpected response: {json.dumps(data, indent=2)[:4000]}")
+            body = orjson.loads(resp.content)
+            org = (body.get("data") or {}).get("organization")
+            if body.get("errors") or not org:
+                if cursor is None:
+                    raise ListingUnavailable("GraphQL listing unavailable for this token")
+                raise RuntimeError(f"Unexpected response: {orjson.dumps(body, option=orjson.OPT_INDENT_2).decode()[:4000]}")
+
+            page = org["repositories"]
+            repos: List[Dict] = []
+            for node in page["nodes"]:
+                if not include_archived and node["isArchived"]:
+                    continue
+                repos.append({
+                    "name": node["name"],
+                    "clone_url": node["url"] + ".git",
+                    "ssh_url": node["sshUrl"],
+                    "archived": node["isArchived"],
+                })
+            bar.update(1)
+            yield repos
 
-            if not data:
+            if not page["pageInfo"]["hasNextPage"]:
                 break
+            cursor = page["pageInfo"]["endCursor"]
+
+            wait_s = rate_limit_pause(resp)
+            if wait_s is not None:
+                tqdm.write(f"Rate limit nearly exhausted. Sleeping {wait_s} seconds...")
+                time.sleep(wait_s)
 
-            for repo in data:
-                if not include_archived and repo.get("archived"):
-                    continue
-                repos.append(repo)
 
-            page += 1
+def iter_repos_search(token: Optional[str]) -> Iterator[List[Dict]]:
+    """Yield the org's non-archived repos page by page through the Search API.
+
+    Archived repos are filtered out server-side, so their payloads never cross
+    the wire. Search caps results at 1000, so ListingUnavailable is raised
+    before anything is yielded if the org has more than that.
+    """
+    headers: Dict[str, str] = {}
+    if token:
+        headers["Authorization"] = f"Bearer {token.strip()}"
+
+    # Search leaves out forks unless asked, unlike the org listing. Sorting by
+    # update time keeps the order stable between page fetches, except for repos
+    # updated meanwhile: those move up, possibly onto a page already fetched.
+    params = {"q": f"org:{ORG} archived:false fork:true", "sort": "updated", "order": "desc", "per_page": 100}
+    first_url = f"{SEARCH_URL}?{urlencode(params)}"
+    url: Optional[str] = first_url
+    total: Optional[int] = None
+    seen: Set[str] = set()
+
+    def get(url: str):
+        while True:
+            resp = SESSION.get(url, headers=headers, timeout=60)
+            wait_s = rate_limit_wait(resp)
+            if wait_s is None:
+                resp.raise_for_status()
+                return resp, orjson.loads(resp.content)
+            tqdm.write(f"Hit rate limit. Sleeping {wait_s} seconds...")
+            time.sleep(wait_s)
+
+    def unseen(items: List[Dict]) -> List[Dict]:
+        repos: List[Dict] = []
+        for item in items:
+            if item["name"] in seen:
+                continue  # an update between page fetches can shift a repo onto a later page
+            seen.add(item["name"])
+            repos.append({"name": item["name"], "clone_url": item["clone_url"], "ssh_url": item["ssh_url"], "archived": False})
+        return repos
+
+    with tqdm(desc="Listing repositories from GitHub", unit="page") as bar:
+        while url:
+            resp, body = get(url)
+            if total is None and (body["total_count"] > SEARCH_MAX_RESULTS or body.get("incomplete_results")):
+                raise ListingUnavailable("Search API cannot return the full repository list")
+            total = body["total_count"]
             bar.update(1)
+            yield unseen(body["items"])
 
-    return repos
+            url = resp.links.get("next", {}).get("url")
+            wait_s = rate_limit_pause(resp)
+            if (url or len(seen) < total) and wait_s is not None:
+                tqdm.write(f"Rate limit nearly exhausted. Sleeping {wait_s} seconds...")
+                time.sleep(wait_s)
+
+        if total is not None and len(seen) < total:
+            # Repos updated during the listing moved up onto pages already fetched
+            _, body = get(first_url)
+            bar.update(1)
+            yield unseen(body["items"])
+
+
+def iter_repos(token: Optional[str], include_archived: bool) -> Iterator[List[Dict]]:
+    """Yield the org's repos one page at a time.
+
+    GraphQL is preferred when a token is available; otherwise, when archived
+    repos are excluded, the Search API filters them server-side. The REST
+    listing is the final fallback.
+    """
+    if token:
+        try:
+            yield from iter_repos_graphql(token, include_archived)
+            return
+        except ListingUnavailable as e:
+            tqdm.write(f"{e}; falling back.")
+    if not include_archived:
+        try:
+            yield from iter_repos_search(token)
+            return
+        except ListingUnavailable as e:
+            tqdm.write(f"{e}; falling back to the REST API.")
+    yield from iter_repos_rest(token, include_archived)
+
+
+def iter_repos_rest(token: Optional[str], include_archived: bool) -> Iterator[List[Dict]]:
+    """Yield the org's repos page by page through the REST API.
+
+    The first page is fetched on its own to learn the page count from its
+    Link rel="last" header; the remaining pages are then requested all at
+    once. Pages are requested with If-None-Match so unchanged pages come back
+    as an empty 304 and are served from the local cache. Repos are sorted by
+    push date, so when the first page only holds repos untouched since the
+    previous run the rest are taken from that run's snapshot instead.
+    """
+    headers: Dict[str, str] = {}
+    if token:
+        headers["Authorization"] = f"Bearer {token.strip()}"
+
+    etags: Dict[str, List] = load_json_file(ETAGS_PATH, {})
+    state: Dict = load_json_file(STATE_PATH, {})
+    last_run: Optional[str] = state.get("last_run")
+    started = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+    params = {
+        "per_page": 100,
+        "type": "all",  # includes public and private if token has scope
+        "sort": "pushed",
+        "direction": "desc",
+    }
+    first_url = f"{API_URL}?{urlencode(params)}"
+    seen: Dict[str, Dict] = {}
+
+    def new_repos(data: List[Dict]) -> List[Dict]:
+        """Record `data` in the snapshot and return the repos not yielded yet."""
+        fresh = []
+        for repo in data:
+            if repo["name"] in seen:
+                continue  # a push between page fetches can shift a repo onto a later page
+            seen[repo["name"]] = slim = {key: repo.get(key) for key in SNAPSHOT_FIELDS}
+            if include_archived or not slim.get("archived"):
+                fresh.append(slim)
+        return fresh
+
+    with tqdm(desc="Listing repositories from GitHub", unit="page") as bar:
+        while True:
+            resp = SESSION.get(first_url, headers=conditional_headers(headers, first_url, etags), timeout=60)
+            wait_s = rate_limit_wait(resp)
+            if wait_s is None:
+                break
+            tqdm.write(f"Hit rate limit. Sleeping {wait_s} seconds...")
+            time.sleep(wait_s)
+
+        first, links = read_page(first_url, resp, etags)
+        bar.update(1)
+        yield new_repos(first)
+
+        last_url = links.get("last")
+        newest = max((repo.get("pushed_at") or "" for repo in first), default="")
+        if last_url and last_run and newest < last_run:
+            # Nothing was pushed since the last run: reuse its snapshot.
+            yield new_repos(state.get("repos", []))
+        elif last_url:
+            last = int(dict(parse_qsl(urlsplit(last_url).query))["page"])
+            bar.total = last
+            bar.refresh()
+            urls = [page_url(last_url, p) for p in range(2, last + 1)]
+            wait_s = rate_limit_pause(resp, needed=len(urls))
+            if wait_s is not None:
+                tqdm.write(f"Rate limit nearly exhausted. Sleeping {wait_s} seconds...")
+                time.sleep(wait_s)
+            for data in asyncio.run(fetch_pages(urls, headers, etags, bar)):
+                yield new_repos(data)
 
+    save_json_file(ETAGS_PATH, etags)
+    save_json_file(STATE_PATH, {"last_run": started, "repos": list(seen.values())})
+
+
+async def run_git_cmd(args: List[str], cwd: Optional[str] = None, quiet: bool = True) -> int:
+    """Run a git command, discarding its output unless `quiet` is False."""
+    # Never let git block on a credential prompt; fail fast so the retry logic kicks in.
+    env = os.environ | GIT_ENV
+    if quiet:
+        # Nothing parses git's output, so don't pump it through Python at all.
+        proc = await asyncio.create_subprocess_exec(*args, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return await proc.wait()
 
-def run_git_cmd(args: List[str], cwd: Optional[str] = None) -> int:
-    """Run a git command and stream output minimally."""
     # We won't parse progress from git; tqdm tracks per-repo completion.
-    proc = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    proc = await asyncio.create_subprocess_exec(*args, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     assert proc.stdout is not None
-    for line in proc.stdout:
-        # Print a trimmed line occasionally to keep users informed without flooding output.
-        if line.strip():
+    async for raw in proc.stdout:
+        line = raw.decode(errors="replace").rstrip()
+        if line:
             # Use tqdm.write so it doesn't break the progress bar rendering.
-            tqdm.write(line.rstrip())
-    return proc.wait()
+            tqdm.write(line)
+    return await proc.wait()
 
 
-def clone_one(repo: Dict, dest_dir: str, use_ssh: bool, shallow: bool, mirror: bool, retries: int = 2) -> str:
-    name = repo["name"]
-    url = repo["ssh_url"] if use_ssh else repo["clone_url"]
+def update_commands(shallow: bool, mirror: bool, jobs: int) -> List[List[str]]:
+    """Git commands that update an existing checkout; only the first one's exit code counts."""
+    if mirror:
+        # For mirror, do a remote update --prune
+        return [GIT + ["remote", "update", "--prune"]]
 
-    # Destination path selection
-    target = os.path.join(dest_dir, name + (".git" if mirror else ""))
+    # Normal repo: fetch + fast-forward default branch if possible
+    fetch = GIT + ["-c", f"submodule.fetchJobs={jobs}", "fetch", "--all", "--prune", f"--jobs={jobs}"]
+    if shallow:
+        # A partial clone's fetch reuses the filter it was cloned with
+        fetch.append("--no-tags")
+    return [fetch, GIT + ["pull", "--ff-only"]]
 
-    # If exists, try to update instead of reclone (unless mirror requested)
-    if os.path.exists(target):
-        try:
-            if mirror:
-                # For mirror, do a remote update --prune
-                code = run_git_cmd(["git", "remote", "update", "--prune"], cwd=target)
-            else:
-                # Normal repo: fetch + fast-forward default branch if possible
-                code = run_git_cmd(["git", "fetch", "--all", "--prune"], cwd=target)
-                if code == 0:
-                    _ = run_git_cmd(["git", "pull", "--ff-only"], cwd=target)
-            if code == 0:
-                return f"updated: {name}"
-        except Exception:
-            pass  # Fall through to re-clone on failure
 
-    # Build clone command
-    cmd = ["git", "clone"]
+def clone_command(shallow: bool, mirror: bool, all_branches: bool, jobs: int) -> List[str]:
+    """Build the `git clone` command shared by every repo; callers append URL and target."""
+    cmd = GIT + ["-c", f"submodule.fetchJobs={jobs}", "clone", "--jobs", str(jobs)]
     if mirror:
         cmd.append("--mirror")
     if shallow and not mirror:
-        cmd += ["--depth", "1", "--no-single-branch"]
-    cmd += [url, target]
+        cmd += ["--depth", "1", "--no-tags"]
+        if all_branches:
+            # Partial clone: only the checked-out tip's trees and blobs are fetched;
+            # with a single branch checkout needs all of them anyway, so it would
+            # only add promisor round trips.
+            cmd += ["--filter=tree:0", "--no-single-branch"]
+        else:
+            cmd.append("--single-branch")
+    return cmd
+
+
+def existing_repos(dest_dir: str, existing: Set[str], mirror: bool) -> Dict[str, str]:
+    """Map repo name to path for entries of `dest_dir` that are git repositories themselves."""
+    marker = "HEAD" if mirror else ".git"
+    repos = {}
+    for e in existing:
+        path = os.path.join(dest_dir, e)
+        if e.endswith(".git") == mirror and os.path.exists(os.path.join(path, marker)):
+            repos[e[:-4] if mirror else e] = path
+    return repos
+
+
+class BatchUpdater:
+    """Updates existing checkouts through one long-running `xargs -P` process.
+
+    Each path is written to xargs' stdin only once the listing has named its
+    repo, and every sh child reports its outcome on stdout, so callers can
+    await their own repo while the rest are still queued. Without xargs
+    (e.g. on Windows) nothing is batched.
+    """
+
+    def __init__(self, dest_dir: str, repos: Dict[str, str], workers: int, shallow: bool, mirror: bool, verbose: bool,
+                 jobs: int) -> None:
+        self.dest_dir = dest_dir
+        self.repos = repos  # see `existing_repos`
+        self.workers = workers
+        self.verbose = verbose
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.pending: Dict[bytes, asyncio.Future] = {}
+        self.readers: List[asyncio.Task] = []
+
+        # Each sh invocation updates one repo and reports "ok" or "failed" with its path (NUL-terminated)
+        first, *rest = update_commands(shallow, mirror, jobs)
+        script = f'cd "$1" && {shlex.join(first)} >&2 || {{ printf "failed %s\\0" "$1"; exit 0; }}'
+        for cmd in rest:
+            script += f"; {shlex.join(cmd)} >&2"
+        self.script = script + '; printf "ok %s\\0" "$1"'
+
+    async def start(self) -> None:
+        if not self.repos or not shutil.which("xargs"):
+            return
+        # Never let git walk up from an entry into a repository enclosing dest_dir
+        env = os.environ | GIT_ENV | {"GIT_CEILING_DIRECTORIES": self.dest_dir}
+        try:
+            # -P is only a ceiling: callers hold a worker slot for each path they write
+            self.proc = await asyncio.create_subprocess_exec(
+                "xargs", "-0", "-P", str(self.workers), "-n", "1", "sh", "-c", self.script, "sh",
+                env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE if self.verbose else subprocess.DEVNULL,
+            )
+        except OSError:
+            return
+        self.readers.append(asyncio.create_task(self.read_outcomes()))
+        if self.verbose:
+            self.readers.append(asyncio.create_task(self.forward_output()))
+
+    async def read_outcomes(self) -> None:
+        assert self.proc is not None and self.proc.stdout is not None
+        try:
+            while True:
+                try:
+                    record = await self.proc.stdout.readuntil(b"\0")
+                except asyncio.IncompleteReadError:
+                    break
+                status, _, path = record[:-1].partition(b" ")
+                future = self.pending.pop(path, None)
+                if future is not None and not future.done():
+                    future.set_result(status == b"ok")
+        finally:
+            # xargs is gone; whatever it did not report was never tried
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_result(None)
+            self.pending.clear()
+
+    async def forward_output(self) -> None:
+        assert self.proc is not None and self.proc.stderr is not None
+        async for raw in self.proc.stderr:
+            line = raw.decode(errors="replace").rstrip()
+            if line:
+                # Use tqdm.write so it doesn't break the progress bar rendering.
+                tqdm.write(line)
+
+    async def update(self, name: str) -> Optional[bool]:
+        """Update repo `name`; None if the batch could not try it, else whether it was updated."""
+        if self.proc is None or self.proc.stdout.at_eof():
+            return None
+        key = os.fsencode(self.repos[name])
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            self.proc.stdin.write(key + b"\0")
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            self.pending.pop(key, None)
+            return None
+        return await future
+
+    async def close(self) -> None:
+        """Close xargs' stdin once no more paths will be written, and wait for it to exit."""
+        if self.proc is None:
+            return
+        self.proc.stdin.close()
+        await asyncio.gather(*self.readers)
+        await self.proc.wait()
+
+
+async def has_local_work(target: str) -> bool:
+    """Whether replacing the checkout `target` would lose anything.
+
+    That is uncommitted, untracked or ignored files, a stash, or commits on
+    local branches that no remote-tracking branch contains. Errors count as
+    local work, so nothing is replaced when in doubt.
+    """
+    checks = [
+        ["status", "--porcelain", "--ignored"],
+        ["stash", "list"],
+        ["rev-list", "-n", "1", "--branches", "--not", "--remotes"],
+    ]
+    for args in checks:
+        proc = await asyncio.create_subprocess_exec(*GIT, *args, cwd=target, env=os.environ | GIT_ENV,
+                                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        out, _ = await proc.communicate()
+        if proc.returncode != 0 or out.strip():
+            return True
+    return False
+
+
+async def cow_reclone(url: str, target: str, git_dir: str, clone_template: List[str], verbose: bool) -> bool:
+    """Re-clone `target` from `url`, seeding it from a reflink snapshot of `git_dir`.
+
+    On a CoW filesystem the snapshot shares extents with the original, so
+    taking it copies no data. The clone borrows its objects via --reference
+    and only fetches what is missing over the network; --dissociate then
+    repacks the borrowed objects locally. Shallow repos cannot serve as a
+    reference, so this is only useful for full and mirror clones. The old
+    checkout is replaced only on success, and it is deleted then: callers
+    must check `has_local_work` first.
+    """
+    staging, fresh = target + ".cow-snapshot", target + ".cow-new"
+    try:
+        proc = await asyncio.create_subprocess_exec("cp", "-a", "--reflink=always", git_dir, staging,
+                                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if await proc.wait() != 0:
+            return False
+        cmd = clone_template + ["--reference-if-able", staging, "--dissociate", url, fresh]
+        if await run_git_cmd(cmd, quiet=not verbose) != 0:
+            return False
+        await asyncio.to_thread(shutil.rmtree, target)
+        os.rename(fresh, target)
+        return True
+    finally:
+        await asyncio.to_thread(shutil.rmtree, staging, True)
+        await asyncio.to_thread(shutil.rmtree, fresh, True)
+
+
+async def clone_one(name: str, url: str, dest_dir: str, clone_template: List[str], shallow: bool, mirror: bool, retries: int = 2,
+                    verbose: bool = False, existing: Optional[Set[str]] = None, jobs: int = 2,
+                    cow_snapshot: bool = False, update: bool = True) -> Tuple[Status, str]:
+    # Destination path selection
+    entry = name + (".git" if mirror else "")
+    target = os.path.join(dest_dir, entry)
+
+    # `existing` is a pre-scanned listing of dest_dir; avoids a stat per repo
+    exists = entry in existing if existing is not None else os.path.exists(target)
+
+    # If exists, try to update instead of reclone (`update` is False when the batch already tried)
+    if exists:
+        if update:
+            try:
+                first, *rest = update_commands(shallow, mirror, jobs)
+                code = await run_git_cmd(first, cwd=target, quiet=not verbose)
+                if code == 0:
+                    for cmd in rest:
+                        _ = await run_git_cmd(cmd, cwd=target, quiet=not verbose)
+                if code == 0:
+                    return Status.UPDATED, name
+            except Exception:
+                pass  # Fall through to re-clone on failure
+
+        if cow_snapshot:
+            # A mirror holds nothing but upstream's refs; a checkout may hold local work
+            if not mirror and await has_local_work(target):
+                log.warning("[%s] update failed; not re-cloning over local changes", name)
+                return Status.FAILED, name
+            git_dir = target if mirror else os.path.join(target, ".git")
+            if await cow_reclone(url, target, git_dir, clone_template, verbose):
+                return Status.CLONED, name
+            log.info("[%s] snapshot re-clone failed; falling back to a plain clone", name)
+
+    cmd = clone_template + [url, target]
 
     attempt = 0
     delay = 5
     while attempt <= retries:
-        code = run_git_cmd(cmd)
+        code = await run_git_cmd(cmd, quiet=not verbose)
         if code == 0:
-            return f"cloned: {name}"
+            return Status.CLONED, name
         attempt += 1
         if attempt <= retries:
-            tqdm.write(f"[{name}] clone failed with exit code {code}. Retrying in {delay}s (attempt {attempt}/{retries})...")
-            time.sleep(delay)
+            log.info("[%s] clone failed with exit code %d. Retrying in %ds (attempt %d/%d)...", name, code, delay, attempt, retries)
+            await asyncio.sleep(delay)
             delay *= 2  # exponential backoff
 
-    return f"failed: {name}"
+    return Status.FAILED, name
+
+
+async def clone_all(pages: Iterator[List[Dict]], workers: int, use_ssh: bool, updater: BatchUpdater,
+                    **clone_kwargs) -> Tuple[List[Tuple[Status, str]], Optional[Exception]]:
+    """Clone or update repos as listing pages arrive, with at most `workers` git processes in flight.
+
+    The listing runs in a worker thread, so clones of the first page start
+    while later pages are still being fetched. All git children are driven
+    from the event loop, so concurrency costs no Python thread per clone.
+    Listed repos that `updater` knows about are updated through its batch
+    first, under the same worker limit; only those it could not update fall
+    through to `clone_one`.
+
+    Returns the per-repo results and the error that stopped the listing, if
+    any; repos queued before that error are still processed.
+    """
+    await updater.start()
+    sem = asyncio.Semaphore(workers)
+    tasks: List[asyncio.Task] = []
+    # Parallel arrays indexed by task number; the URL flavour is chosen once here
+    names: List[str] = []
+    urls: List[str] = []
+    url_key = "ssh_url" if use_ssh else "clone_url"
+
+    finished = 0  # completions not yet reported to the progress bar
+
+    with tqdm(total=None, desc="Cloning repositories", unit="repo") as pbar:
+        async def task(i: int) -> Tuple[Status, str]:
+            nonlocal finished
+            try:
+                updated: Optional[bool] = None
+                if names[i] in updater.repos:
+                    async with sem:
+                        updated = await updater.update(names[i])
+                    if updated:
+                        return Status.UPDATED, names[i]
+                async with sem:
+                    return await clone_one(names[i], urls[i], update=updated is None, **clone_kwargs)
+            except Exception as e:
+                log.warning("[%s] %s", names[i], e)
+                return Status.FAILED, names[i]
+            finally:
+                finished += 1
+
+        def flush_progress() -> None:
+            nonlocal finished
+            if finished:
+                pbar.update(finished)
+                finished = 0
+
+        async def report_progress() -> None:
+            # Batch bar updates instead of one per repo, which matters at high --workers
+            while True:
+                await asyncio.sleep(PROGRESS_INTERVAL)
+                flush_progress()
+
+        reporter = asyncio.create_task(report_progress())
+        listing_error: Optional[Exception] = None
+        try:
+            try:
+                while (page := await asyncio.to_thread(next, pages, None)) is not None:
+                    for r in page:
+                        names.append(r["name"])
+                        urls.append(r[url_key])
+                        tasks.append(asyncio.create_task(task(len(tasks))))
+            except Exception as e:
+                listing_error = e  # clones already queued still run
+
+            tqdm.write(f"Found {len(tasks)} repositories to process")
+            pbar.total = len(tasks)
+            pbar.refresh()
+            results = list(await asyncio.gather(*tasks))
+            return results, listing_error
+        finally:
+            reporter.cancel()
+            flush_progress()
+            await updater.close()
+
+
+def filesystem_type(path: str) -> str:
+    """Name of the filesystem holding `path` (e.g. "btrfs"), or "" if unknown."""
+    try:
+        out = subprocess.run(["stat", "-f", "-c", "%T", path], capture_output=True, text=True, check=False)
+    except OSError:
+        return ""
+    return out.stdout.strip() if out.returncode == 0 else ""
+
+
+def available_cpus() -> int:
+    """CPUs this process can actually use.
+
+    Honours the scheduler affinity mask and a cgroup v2 CPU quota, which
+    `os.cpu_count()` ignores inside containers.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 4
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r", encoding="utf-8") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def start_ssh_master() -> None:
+    """Share one authenticated SSH connection to GitHub across all git processes.
+
+    Uses OpenSSH ControlMaster so each clone opens a channel on an existing
+    connection instead of doing its own key exchange and authentication.
+    """
+    if os.environ.get("GIT_SSH_COMMAND"):
+        return  # Respect the user's own SSH setup
+    if os.name == "nt":
+        return  # Win32-OpenSSH has no ControlMaster support
+
+    # Keep the socket path short: sun_path is capped at 104 bytes on macOS,
+    # and its $TMPDIR alone is about 49 characters.
+    ctl_dir = tempfile.mkdtemp(prefix="ceo-ssh-", dir="/tmp")
+    opts = [
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={ctl_dir}/cm-%C",
+        "-o", "ControlPersist=600",
+        "-o", "ServerAliveInterval=30",
+    ]
+    os.environ["GIT_SSH_COMMAND"] = shlex.join(["ssh"] + opts)
+
+    # Pre-warm the master connection so workers don't race to create it
+    subprocess.run(["ssh"] + opts + ["-Nf", SSH_HOST], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+
+    def stop() -> None:
+        subprocess.run(["ssh"] + opts + ["-O", "exit", SSH_HOST], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        shutil.rmtree(ctl_dir, ignore_errors=True)
+
+    atexit.register(stop)
 
 
 def main():
+    # Clones are network-bound, so run several per CPU
+    cpus = available_cpus()
+
     parser = argparse.ArgumentParser(description=f"Clone all repositories from the '{ORG}' GitHub organization with a progress bar.")
     parser.add_argument("--dest", default="electronicarts", help="Destination folder to hold all repos (default: electronicarts)")
     parser.add_argument("--token", default=os.getenv("GITHUB_TOKEN") or os.getenv("GH_TOKEN"), help="GitHub token to increase API limits (env: GITHUB_TOKEN or GH_TOKEN)")
     parser.add_argument("--ssh", action="store_true", help="Use SSH URLs instead of HTTPS (requires your SSH keys configured)")
     parser.add_argument("--include-archived", action="store_true", help="Include archived repositories (default: exclude)")
-    parser.add_argument("--workers", type=int, default=min(8, (os.cpu_count() or 4)), help="Number of concurrent clones (default: up to 8)")
+    parser.add_argument("--workers", type=int, default=min(32, cpus * 4), help="Number of concurrent clones (default: 4 per available CPU, up to 32)")
     parser.add_argument("--full", action="store_true", help="Do a full clone instead of shallow depth=1")
     parser.add_argument("--mirror", action="store_true", help="Use --mirror (bare) clone (implies full clone)")
+    parser.add_argument("--jobs", type=int, default=None, help="Parallel fetch jobs inside each git process (default: 2, or more with few workers)")
+    parser.add_argument("--all-branches", action="store_true", help="Shallow-clone every branch instead of only the default one")
+    parser.add_argument("--cow-snapshot", action="store_true", help="With --full/--mirror on Btrfs/XFS, re-clone repos whose update failed from a reflink snapshot of their objects; this replaces the checkout, so it is skipped when the checkout has local changes")
+    parser.add_argument("--verbose", action="store_true", help="Stream git output and per-repo retry messages to the console (default: discard them)")
 
     args = parser.parse_args()
     dest_dir = os.path.abspath(args.dest)
     os.makedirs(dest_dir, exist_ok=True)
 
-    try:
-        repos = fetch_all_repos(token=args.token, include_archived=args.include_archived)
-    except Exception as e:
-        print(f"Error fetching repositories list: {e}", file=sys.stderr)
-        sys.exit(2)
+    log.addHandler(TqdmHandler())
+    log.setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    shallow = not args.full and not args.mirror
 
-    if not repos:
+    cow_snapshot = False
+    if args.cow_snapshot and shallow:
+        print("Ignoring --cow-snapshot: shallow clones cannot be used as a reference; combine it with --full or --mirror",
+              file=sys.stderr)
+    elif args.cow_snapshot:
+        fs_type = filesystem_type(dest_dir)
+        cow_snapshot = fs_type in COW_FILESYSTEMS
+        if not cow_snapshot:
+            print(f"Ignoring --cow-snapshot: {dest_dir} is on {fs_type or 'an unknown filesystem'}, not Btrfs/XFS", file=sys.stderr)
+
+    if args.ssh:
+        start_ssh_master()
+
+    # One directory listing up front instead of a stat per repository
+    with os.scandir(dest_dir) as it:
+        existing = {e.name for e in it if e.is_dir()}
+
+    # Limit workers to a sane number for git/IO
+    workers = max(1, min(args.workers, 32))
+    # Parallelism inside each git process (submodules, multiple remotes). Aim for
+    # workers * jobs around 2x the CPU count, but never below 2 per process; with
+    # the default --workers (4 per CPU) that budget is already spent, so it is 2.
+    jobs = max(1, args.jobs) if args.jobs is not None else max(2, (2 * cpus) // workers)
+    print(f"Cloning repositories into {dest_dir} as they are listed")
+    pages = iter_repos(token=args.token, include_archived=args.include_archived)
+    updater = BatchUpdater(dest_dir, existing_repos(dest_dir, existing, args.mirror), workers, shallow=shallow,
+                           mirror=args.mirror, verbose=args.verbose, jobs=jobs)
+    clone_template = clone_command(shallow, args.mirror, args.all_branches, jobs)
+    results, listing_error = asyncio.run(clone_all(pages, workers, args.ssh, updater, dest_dir=dest_dir,
+                                                   clone_template=clone_template, shallow=shallow, mirror=args.mirror,
+                                                   verbose=args.verbose, existing=existing, jobs=jobs,
+                                                   cow_snapshot=cow_snapshot))
+    if listing_error is not None:
+        print(f"Error fetching repositories list: {listing_error}", file=sys.stderr)
+
+    if not results:
+        if listing_error is not None:
+            sys.exit(2)
         print("No repositories found. (Maybe the org is empty or your token lacks access?)")
         return
 
-    # Choose URL type ahead of time to avoid per-thread branching
-    selected = []
-    for r in repos:
-        selected.append({
-            "name": r.get("name"),
-            "clone_url": r.get("clone_url"),
-            "ssh_url": r.get("ssh_url"),
-        })
-
-    total = len(selected)
-    print(f"Found {total} repositories to process (dest: {dest_dir})")
-
-    shallow = not args.full and not args.mirror
-
-    results: List[str] = []
-    # Use a thread-safe tqdm progress bar
-    with tqdm(total=total, desc="Cloning repositories", unit="repo") as pbar:
-        def task(r: Dict) -> str:
-            out = clone_one(r, dest_dir=dest_dir, use_ssh=args.ssh, shallow=shallow, mirror=args.mirror)
-            pbar.update(1)
-            return out
-
-        # Limit workers to a sane number for git/IO
-        workers = max(1, min(args.workers, 16))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
-            futures = [ex.submit(task, r) for r in selected]
-            for fut in concurrent.futures.as_completed(futures):
-                try:
-                    res = fut.result()
-                    results.append(res)
-                except Exception as e:
-                    results.append(f"failed: {e}")
+    total = len(results)
 
     # Summary
-    ok = sum(1 for r in results if r.startswith(("cloned:", "updated:")))
-    failed = [r for r in results if r.startswith("failed:")]
+    counts = collections.Counter(status for status, _ in results)
+    failed = [name for status, name in results if status is Status.FAILED]
     print("\nSummary:")
-    print(f"  Success: {ok}/{total}")
+    print(f"  Success: {counts[Status.CLONED] + counts[Status.UPDATED]}/{total}")
     if failed:
         print("  Failures:")
-        for item in failed:
-            print(f"    - {item}")
+        for name in failed:
+            print(f"    - {name}")
 
     # Write a machine-readable log
     log_path = os.path.join(dest_dir, f"clone_summary_{int(time.time())}.log")
-    with open(log_path, "w", encoding="utf-8") as f:
-        for line in results:
-            f.write(line + "\n")
+    lines = [f"{status.name.lower()}: {name}\n" for status, name in results]
+    with open(log_path, "wb") as f:
+        f.write("".join(lines).encode("utf-8"))
     print(f"\nDetailed log saved to: {log_path}")
 
+    if listing_error is not None:
+        sys.exit(2)  # the list above is incomplete
+
 
 if __name__ == "__main__":
     main()